@@ -1,26 +1,31 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, make_response
 from functools import wraps
+import hashlib
+import json
+import os
 import database as db
 
 # Create a 'Blueprint' for the admin section. This helps organize routes.
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# Salts the dashboard ETag so a deploy that changes the template invalidates cached pages.
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'admin_dashboard.html'), 'rb') as _template:
+    _DASHBOARD_TEMPLATE_VERSION = hashlib.md5(_template.read()).hexdigest()
+
 # --- Admin Authentication Decorator ---
 def admin_required(f):
     """A decorator to ensure a user is a logged-in admin."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # Prefer full Supabase session if present
-        access_token = session.get('access_token')
-        if access_token and session.get('refresh_token'):
-            sb = db.get_supabase_client()
-            sb.auth.set_session(access_token, session.get('refresh_token'))
+        if session.get('access_token') and session.get('refresh_token'):
             try:
-                user = sb.auth.get_user()
+                # The session was verified against the auth server when the client was
+                # bound, which may have been up to 30 seconds ago.
+                sb, user = db.get_user_client(session)
                 if not user:
                     raise Exception("User not found")
-                profile = sb.table('profiles').select('is_admin').eq('id', user.user.id).single().execute().data
-                if not profile or not profile.get('is_admin'):
+                if not db.is_admin_by_user_id(user.user.id):
                     flash("You do not have permission to access this page.", "error")
                     return redirect(url_for('dashboard'))
                 return f(sb, *args, **kwargs)
@@ -35,13 +40,12 @@ def admin_required(f):
         sb_admin = db.get_supabase_client(service_role=True)
         try:
             user_id = session.get('user_id')
-            profile_query = sb_admin.table('profiles').select('id, is_admin')
             if user_id:
-                profile_query = profile_query.eq('id', user_id)
+                is_admin = db.is_admin_by_user_id(user_id)
             else:
-                profile_query = profile_query.eq('email', session.get('user_email'))
-            profile = profile_query.single().execute().data
-            if not profile or not profile.get('is_admin'):
+                profile = sb_admin.table('profiles').select('id, is_admin').eq('email', session.get('user_email')).limit(1).single().execute().data
+                is_admin = bool(profile and profile.get('is_admin'))
+            if not is_admin:
                 flash("You do not have permission to access this page.", "error")
                 return redirect(url_for('dashboard'))
         except Exception as e:
@@ -51,23 +55,46 @@ def admin_required(f):
         return f(sb_admin, *args, **kwargs)
     return decorated_function
 
+def _current_page():
+    return max(request.args.get('page', 0, type=int), 0)
+
 # --- Admin Panel Routes ---
 @admin_bp.route('/')
 @admin_required
 def dashboard(sb):
-    """Main admin dashboard. Shows a list of all users."""
-    all_users = db.admin_get_all_users()
-    return render_template('admin_dashboard.html', users=all_users, selected_user=None)
+    """Main admin dashboard. Shows one page of users."""
+    page = _current_page()
+    users, has_more = db.admin_get_users_page(page)
+
+    # The page is a pure function of the user list unless flash messages are waiting
+    # to be rendered, so let the browser revalidate it with an ETag in that case.
+    etag = None
+    if not session.get('_flashes'):
+        etag = hashlib.md5(json.dumps([_DASHBOARD_TEMPLATE_VERSION, page, users, has_more], sort_keys=True).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(render_template('admin_dashboard.html', users=users, page=page,
+                                             has_more=has_more, selected_user=None))
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @admin_bp.route('/user/<user_id>')
 @admin_required
 def view_user(sb, user_id):
     """Shows the scrips and recipients for a specific user."""
-    all_users = db.admin_get_all_users()
+    page = _current_page()
+    users, has_more = db.admin_get_users_page(page)
     selected_user_data = db.admin_get_user_details(user_id)
     
     return render_template('admin_dashboard.html', 
-                           users=all_users, 
+                           users=users, 
+                           page=page,
+                           has_more=has_more,
                            selected_user=selected_user_data)
 
 @admin_bp.route('/add_scrip', methods=['POST'])
@@ -2,25 +2,33 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, render_template, redirect, url_for, session, flash, jsonify
-from supabase import create_client
-import pandas as pd
+from flask import Flask, Response, request, render_template, redirect, url_for, session, flash, jsonify
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import database as db
-from firebase_admin import auth
+import company_data
 from admin import admin_bp
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Encodes jsonify() responses with orjson, keeping Flask's fallback for other types."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        # orjson has no object_hook; the session serializer needs it to untag values.
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "a-super-secret-key-for-local-testing")
 app.register_blueprint(admin_bp)
 
-# --- Load local company data into memory for searching ---
-try:
-    company_df = pd.read_csv('indian_stock_tickers.csv')
-    company_df['BSE Code'] = company_df['BSE Code'].astype(str).fillna('')
-except FileNotFoundError:
-    print("[CRITICAL ERROR] The company list 'indian_stock_tickers.csv' was not found. Search will not work.")
-    company_df = pd.DataFrame(columns=['BSE Code', 'Company Name'])
-
+# Bring up Firebase and Supabase at import (once in the gunicorn master with --preload)
+# rather than inside the first login request.
+db.warmup()
 
 # --- Unified Authentication Routes ---
 @app.route('/login')
@@ -36,7 +44,7 @@ def verify_phone_token():
         return jsonify({"success": False, "error": "No token provided."}), 400
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = db.verify_firebase_token(id_token)
         user_result = db.find_or_create_supabase_user(decoded_token)
 
         if user_result.get('error'):
@@ -72,7 +80,7 @@ def verify_google_token():
         return jsonify({"success": False, "error": "No token provided."}), 400
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = db.verify_firebase_token(id_token)
         user_result = db.find_or_create_supabase_user(decoded_token)
 
         if user_result.get('error'):
@@ -108,13 +116,11 @@ def logout():
 # --- Helper function to get an authenticated Supabase client ---
 def get_authenticated_client():
     # If full Supabase session is present, use it
-    access_token = session.get('access_token')
-    refresh_token = session.get('refresh_token')
-    if access_token and refresh_token:
-        sb = db.get_supabase_client()
+    if session.get('access_token') and session.get('refresh_token'):
         try:
-            sb.auth.set_session(access_token, refresh_token)
-            return sb
+            sb, _ = db.get_user_client(session)
+            if sb:
+                return sb
         except Exception as e:
             print(f"Session authentication error: {e}")
 
@@ -133,8 +139,9 @@ def dashboard():
         return redirect(url_for('login'))
 
     user_id = session.get('user_id')
-    monitored_scrips = db.get_user_scrips(sb, user_id)
-    telegram_recipients = db.get_user_recipients(sb, user_id)
+    data_version = session.get('data_version')
+    monitored_scrips = db.get_user_scrips(sb, user_id, data_version)
+    telegram_recipients = db.get_user_recipients(sb, user_id, data_version)
     
     return render_template('dashboard.html', 
                            monitored_scrips=monitored_scrips,
@@ -151,13 +158,14 @@ def search():
 
     query = request.args.get('query', '')
     if not query or len(query) < 2:
-        return jsonify({"matches": []})
-    
-    mask = (company_df['Company Name'].str.contains(query, case=False, na=False)) | \
-           (company_df['BSE Code'].str.startswith(query))
-           
-    matches = company_df[mask].head(10)
-    return jsonify({"matches": matches.to_dict('records')})
+        return Response(b'', mimetype='application/x-ndjson')
+
+    # Newline-delimited JSON: one match per line, flushed as it is produced.
+    def generate():
+        for match in company_data.search_companies(query):
+            yield orjson.dumps(match) + b'\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 # --- Data Management Routes (Protected) ---
@@ -172,18 +180,12 @@ def add_scrip():
 
     # If company name is not provided, look it up exactly by BSE Code from CSV
     if not company_name:
-        try:
-            match = company_df[company_df['BSE Code'] == bse_code]
-            if not match.empty:
-                company_name = str(match.iloc[0]['Company Name'])
-            else:
-                flash('Scrip code not found in list. Please check the BSE code.', 'error')
-                return redirect(url_for('dashboard'))
-        except Exception:
-            flash('There was an issue looking up the scrip. Try again.', 'error')
+        company_name = company_data.CODE_TO_NAME.get(bse_code)
+        if not company_name:
+            flash('Scrip code not found in list. Please check the BSE code.', 'error')
             return redirect(url_for('dashboard'))
 
-    db.add_user_scrip(sb, user_id, bse_code, company_name)
+    session['data_version'] = db.add_user_scrip(sb, user_id, bse_code, company_name)
     return redirect(url_for('dashboard'))
 
 @app.route('/delete_scrip', methods=['POST'])
@@ -193,7 +195,7 @@ def delete_scrip():
 
     user_id = session.get('user_id')
     bse_code = request.form['scrip_code']
-    db.delete_user_scrip(sb, user_id, bse_code)
+    session['data_version'] = db.delete_user_scrip(sb, user_id, bse_code)
     return redirect(url_for('dashboard'))
 
 @app.route('/add_recipient', methods=['POST'])
@@ -203,7 +205,7 @@ def add_recipient():
     
     user_id = session.get('user_id')
     chat_id = request.form['chat_id']
-    db.add_user_recipient(sb, user_id, chat_id)
+    session['data_version'] = db.add_user_recipient(sb, user_id, chat_id)
     return redirect(url_for('dashboard'))
 
 @app.route('/delete_recipient', methods=['POST'])
@@ -213,11 +215,11 @@ def delete_recipient():
     
     user_id = session.get('user_id')
     chat_id = request.form['chat_id']
-    db.delete_user_recipient(sb, user_id, chat_id)
+    session['data_version'] = db.delete_user_recipient(sb, user_id, chat_id)
     return redirect(url_for('dashboard'))
 
 
 if __name__ == '__main__':
-    db.get_supabase_client()
-    db.initialize_firebase() # Initialize Firebase on startup
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    db.start_firebase_key_refresher()
+    # Local development only; production runs under gunicorn (see render.yaml).
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False)
@@ -0,0 +1,97 @@
+"""Company list and search indexes, loaded once per process on first import."""
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# --- Load local company data into memory for searching ---
+try:
+    # Only the code and name are used. Read them as text; codes are identifiers, not numbers.
+    company_df = pd.read_csv(
+        'indian_stock_tickers.csv',
+        usecols=['BSE Code', 'Company Name'],
+        dtype=str,
+        keep_default_na=False,
+    )
+except FileNotFoundError:
+    print("[CRITICAL ERROR] The company list 'indian_stock_tickers.csv' was not found. Search will not work.")
+    company_df = pd.DataFrame(columns=['BSE Code', 'Company Name'])
+
+# Search arrays are built once at import; the CSV never changes at runtime, so
+# /search only has to scan these instead of re-lowercasing the column per request.
+_names_lower = company_df['Company Name'].str.lower().to_numpy(dtype=str)
+_codes = company_df['BSE Code'].to_numpy(dtype=str)
+_records = company_df.to_dict('records')
+
+# O(1) name-by-code lookups; the first row wins if the CSV lists a code twice.
+CODE_TO_NAME = {}
+for _code, _name in zip(company_df['BSE Code'], company_df['Company Name']):
+    CODE_TO_NAME.setdefault(_code, _name)
+
+# Nothing reads the frame after this point; drop it so each worker keeps only the arrays.
+del company_df
+
+# Nothing longer than the longest name or code can match, so such queries skip the indexes.
+_MAX_QUERY_LENGTH = max(map(len, [*_names_lower, *_codes]), default=0)
+
+_CODE_PREFIX_LENGTHS = (2, 3, 4)
+_NO_ROWS = np.empty(0, dtype=np.int32)
+
+def _freeze_postings(postings):
+    # Rows are appended in table order, so every posting list is already sorted.
+    return {key: np.array(rows, dtype=np.int32) for key, rows in postings.items()}
+
+def _build_ngram_index(names, n):
+    """Maps every n-character slice of a lowercased name to the rows containing it."""
+    postings = defaultdict(list)
+    for row, name in enumerate(names):
+        for gram in {name[i:i + n] for i in range(len(name) - n + 1)}:
+            postings[gram].append(row)
+    return _freeze_postings(postings)
+
+def _build_code_prefix_index(codes):
+    """Maps the leading 2-4 characters of each BSE code to the rows starting with them."""
+    postings = defaultdict(list)
+    for row, code in enumerate(codes):
+        for length in _CODE_PREFIX_LENGTHS:
+            if len(code) >= length:
+                postings[code[:length]].append(row)
+    return _freeze_postings(postings)
+
+# Bigrams answer two-character queries exactly; longer queries intersect trigrams.
+_bigram_index = _build_ngram_index(_names_lower, 2)
+_trigram_index = _build_ngram_index(_names_lower, 3)
+_code_prefix_index = _build_code_prefix_index(_codes)
+
+def _name_rows(q):
+    """Rows whose lowercased name contains q, via n-gram postings; q needs two characters."""
+    if len(q) < 2:
+        return _NO_ROWS
+    if len(q) == 2:
+        return _bigram_index.get(q, _NO_ROWS)
+    postings = [_trigram_index.get(q[i:i + 3]) for i in range(len(q) - 2)]
+    if any(p is None for p in postings):
+        return _NO_ROWS
+    postings.sort(key=len)
+    candidates = postings[0]
+    for p in postings[1:]:
+        candidates = np.intersect1d(candidates, p, assume_unique=True)
+        if not candidates.size:
+            return _NO_ROWS
+    # Shared trigrams don't guarantee a contiguous match, so confirm each candidate.
+    return np.array([r for r in candidates if q in _names_lower[r]], dtype=np.int32)
+
+def _code_rows(query):
+    """Rows whose BSE code starts with query, via the code prefix postings."""
+    longest = _CODE_PREFIX_LENGTHS[-1]
+    rows = _code_prefix_index.get(query[:longest], _NO_ROWS)
+    if len(query) > longest:
+        rows = np.array([r for r in rows if _codes[r].startswith(query)], dtype=np.int32)
+    return rows
+
+def search_companies(query, limit=10):
+    """Returns up to `limit` company records matching query by name substring or code prefix."""
+    if len(query) > _MAX_QUERY_LENGTH:
+        return []
+    rows = np.union1d(_name_rows(query.lower()), _code_rows(query))[:limit]
+    return [_records[i] for i in rows]
@@ -1,8 +1,14 @@
 import os
+import hashlib
+import threading
+import time
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+from gotrue.constants import EXPIRY_MARGIN
 from gotrue.errors import AuthApiError
 import firebase_admin
 from firebase_admin import credentials, auth
+from cache import TTLCache
 
 # --- Firebase Admin SDK Initialization ---
 firebase_app = None
@@ -33,6 +39,72 @@ def initialize_firebase():
     except Exception as e:
         print(f"CRITICAL ERROR: Failed to initialize Firebase Admin SDK: {e}")
 
+# --- Firebase Public Key Refresh ---
+# firebase_admin caches Google's token-signing certs per their Cache-Control header and
+# re-fetches them inside whichever verify_id_token call finds them expired. A background
+# thread re-fetches them well before that, so logins always verify against a warm cache.
+FIREBASE_KEY_REFRESH_SECONDS = 50 * 60
+_key_refresher_pid = None
+_key_refresher_lock = threading.Lock()
+
+def _refresh_firebase_public_keys():
+    # firebase_admin exposes no public hook for this; go through its token verifier.
+    verifier = auth._get_client(firebase_app)._token_verifier
+    verifier.request(verifier.id_token_verifier.cert_url, headers={'Cache-Control': 'no-cache'})
+
+def _firebase_key_refresher():
+    while True:
+        try:
+            _refresh_firebase_public_keys()
+        except Exception as e:
+            print(f"Firebase public key refresh failed: {e}")
+        time.sleep(FIREBASE_KEY_REFRESH_SECONDS)
+
+def start_firebase_key_refresher():
+    """Starts the key refresher in this process; threads don't survive gunicorn's fork."""
+    global _key_refresher_pid
+    with _key_refresher_lock:
+        if not firebase_app or _key_refresher_pid == os.getpid():
+            return
+        _key_refresher_pid = os.getpid()
+    threading.Thread(target=_firebase_key_refresher, name='firebase-key-refresher', daemon=True).start()
+
+# --- Firebase Token Verification ---
+# Set AUTH_SKIP_ADMIN_LOOKUP=1 to identify users from verified token claims alone.
+SKIP_ADMIN_LOOKUP = os.environ.get("AUTH_SKIP_ADMIN_LOOKUP") == "1"
+
+# Both caches are bounded by the token's `exp` claim, so nothing outlives the credential.
+_decoded_token_cache = TTLCache(maxsize=10_000, ttl=300)
+_firebase_user_cache = TTLCache(maxsize=10_000, ttl=300)
+
+def _ttl_until_expiry(decoded_token, cache):
+    return min(cache.ttl, decoded_token.get('exp', 0) - time.time())
+
+def verify_firebase_token(id_token: str):
+    """Verifies a Firebase ID token, reusing the decoded claims for repeat submissions."""
+    key = hashlib.sha256(id_token.encode()).hexdigest()[:32]
+    decoded_token = _decoded_token_cache.get(key)
+    if decoded_token is None:
+        initialize_firebase()
+        decoded_token = auth.verify_id_token(id_token)
+        ttl = _ttl_until_expiry(decoded_token, _decoded_token_cache)
+        if ttl > 0:
+            _decoded_token_cache.set(key, decoded_token, ttl=ttl)
+    return decoded_token
+
+def _get_firebase_user_contact(decoded_token):
+    """Returns (email, phone_number, provider_email) from the Firebase Admin API, cached per UID."""
+    provider_uid = decoded_token['uid']
+    contact = _firebase_user_cache.get(provider_uid)
+    if contact is None:
+        record = auth.get_user(provider_uid)
+        provider_email = next((p.email for p in record.provider_data or [] if p.email), None)
+        contact = (record.email, record.phone_number, provider_email)
+        ttl = _ttl_until_expiry(decoded_token, _firebase_user_cache)
+        if ttl > 0:
+            _firebase_user_cache.set(provider_uid, contact, ttl=ttl)
+    return contact
+
 # --- Supabase Client Initialization ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
@@ -40,6 +112,7 @@ SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
 
 supabase_anon: Client = None
 supabase_service: Client = None
+_supabase_init_lock = threading.Lock()
 
 def get_supabase_client(service_role=False):
     """Initializes and returns the appropriate Supabase client."""
@@ -49,17 +122,120 @@ def get_supabase_client(service_role=False):
             if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
                 print("CRITICAL: Supabase Service Key not set.")
                 return None
-            supabase_service = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+            with _supabase_init_lock:
+                if supabase_service is None:
+                    supabase_service = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
         return supabase_service
     else:
         if supabase_anon is None:
             if not SUPABASE_URL or not SUPABASE_KEY:
                 print("CRITICAL: Supabase Anon Key not set.")
                 return None
-            supabase_anon = create_client(SUPABASE_URL, SUPABASE_KEY)
+            with _supabase_init_lock:
+                if supabase_anon is None:
+                    supabase_anon = create_client(SUPABASE_URL, SUPABASE_KEY)
         return supabase_anon
 
+# Clients bound to one user's Supabase session, keyed by access token. set_session costs
+# an auth round-trip, so a bound client is reused for a short window well inside the
+# token lifetime instead of re-binding the shared anon client on every request.
+# No login path stores Supabase tokens today (find_or_create_supabase_user returns no
+# session), so this only serves sessions that carry access_token/refresh_token.
+_user_client_cache = TTLCache(maxsize=512, ttl=30)
+
+def _bind_user_client(access_token: str, refresh_token: str):
+    # The default ClientOptions share one session store across clients; keep each in memory.
+    # No auto-refresh: gotrue would start a timer thread per client, and those timers would
+    # spend the rotating refresh token without handing the new pair back to the Flask session.
+    options = ClientOptions(persist_session=False, auto_refresh_token=False)
+    client = create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+    user_session = client.auth.set_session(access_token, refresh_token).session
+    if not user_session:
+        raise ValueError("Supabase session could not be restored")
+    client.postgrest.auth(user_session.access_token)
+    return client, user_session
+
+def _cache_user_client(client, user_session, *access_tokens):
+    # Evict a second before gotrue's expiry margin (it compares against a rounded clock),
+    # so a cached client is never used once its token is due for a refresh.
+    ttl = min(_user_client_cache.ttl, user_session.expires_at - time.time() - EXPIRY_MARGIN - 1)
+    if ttl > 0:
+        for token in access_tokens:
+            _user_client_cache.set(token, (client, user_session), ttl=ttl)
+
+def get_user_client(tokens):
+    """
+    Returns (client, user_session) for the Supabase tokens in `tokens` (the Flask session):
+    an anon-key client authenticated as that user, for RLS-bound queries. When the bind
+    had to refresh an expired access token, the rotated pair is written back to `tokens`.
+    """
+    access_token = tokens.get('access_token')
+    cached = _user_client_cache.get(access_token)
+    if cached is not None:
+        return cached
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("CRITICAL: Supabase Anon Key not set.")
+        return None, None
+    client, user_session = _bind_user_client(access_token, tokens.get('refresh_token'))
+    _cache_user_client(client, user_session, access_token, user_session.access_token)
+    if user_session.access_token != access_token:
+        tokens['access_token'] = user_session.access_token
+        tokens['refresh_token'] = user_session.refresh_token
+    return client, user_session
+
+def warmup():
+    """Initializes Firebase and both Supabase clients so no user request pays for it."""
+    initialize_firebase()
+    get_supabase_client()
+    get_supabase_client(service_role=True)
+
+# --- Admin Role Lookups ---
+# Admin checks run on every admin page hit; roles change rarely, so the TTL bounds how long
+# a revocation made outside this process can go unnoticed.
+_admin_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def is_admin_by_user_id(user_id: str) -> bool:
+    """Returns whether the profile is flagged as admin, cached per user for a minute."""
+    cached = _admin_cache.get(user_id)
+    if cached is not None:
+        return cached
+    sb_admin = get_supabase_client(service_role=True)
+    profile = sb_admin.table('profiles').select('is_admin').eq('id', user_id).single().execute().data
+    is_admin = bool(profile and profile.get('is_admin'))
+    _admin_cache.set(user_id, is_admin)
+    return is_admin
+
+def invalidate_admin_cache(user_id: str):
+    """Drops the cached admin flag, for use after changing a user's role."""
+    _admin_cache.pop(user_id)
+
 # --- Unified User Authentication Logic ---
+def _find_or_link_profile(sb_admin, uid_column, provider_uid, email):
+    """
+    Returns the profile matching the provider UID, or the one matching email after
+    linking the UID to it. Uses the find_or_link_profile RPC (one round-trip) and
+    falls back to table queries if the migration has not been applied yet.
+    """
+    try:
+        rows = sb_admin.rpc('find_or_link_profile', {
+            'p_provider_uid': provider_uid,
+            'p_uid_column': uid_column,
+            'p_email': email,
+        }).execute().data
+        return rows[0] if rows else None
+    except Exception as e:
+        print(f"find_or_link_profile RPC failed, using table queries: {e}")
+
+    profile_response = sb_admin.table('profiles').select('id, email').eq(uid_column, provider_uid).limit(1).execute()
+    profile = profile_response.data[0] if profile_response.data else None
+
+    if not profile and email:
+        profile_response = sb_admin.table('profiles').select('id, email').eq('email', email).limit(1).execute()
+        profile = profile_response.data[0] if profile_response.data else None
+        if profile:
+            sb_admin.table('profiles').update({uid_column: provider_uid}).eq('id', profile['id']).execute()
+    return profile
+
 def find_or_create_supabase_user(decoded_token):
     """
     Finds a user in Supabase by their Firebase/Google UID or email.
@@ -73,53 +249,40 @@ def find_or_create_supabase_user(decoded_token):
         return {"session": None, "error": "Admin client not configured."}
 
     provider_uid = decoded_token['uid']
-    
-    # Prefer values present in the verified token
-    email = decoded_token.get('email')
-    phone_number = decoded_token.get('phone_number')
+    provider = decoded_token['firebase']['sign_in_provider']
 
-    try:
-        # Only call Admin API if we still miss fields
-        if not email or not phone_number:
-            firebase_user_record = auth.get_user(provider_uid)
-            email = email or firebase_user_record.email
-            phone_number = phone_number or firebase_user_record.phone_number
-
-            if not email and firebase_user_record.provider_data:
-                for provider_info in firebase_user_record.provider_data:
-                    if provider_info.email:
-                        email = provider_info.email
-                        break
-    except Exception:
-        # Ignore Admin lookup failures; we keep whatever we have from the token
-        pass
+    # Prefer values present in the verified token, including linked identities
+    identities = decoded_token['firebase'].get('identities') or {}
+    email = decoded_token.get('email') or next(iter(identities.get('email') or []), None)
+    phone_number = decoded_token.get('phone_number') or next(iter(identities.get('phone') or []), None)
+
+    # The token identifies the user whenever it carries an email or phone (Google
+    # sign-ins always do); the Admin API round-trip is only needed when it has neither.
+    if not email and not phone_number and provider != 'google.com' and not SKIP_ADMIN_LOOKUP:
+        try:
+            record_email, record_phone, provider_email = _get_firebase_user_contact(decoded_token)
+            email = record_email or provider_email
+            phone_number = record_phone
+        except Exception:
+            # Ignore Admin lookup failures; we keep whatever we have from the token
+            pass
 
-    provider = decoded_token['firebase']['sign_in_provider']
     uid_column = 'google_uid' if provider == 'google.com' else 'firebase_uid'
 
-    # 1. Try to find an existing user
-    profile_response = sb_admin.table('profiles').select('id, email').eq(uid_column, provider_uid).execute()
-    profile = profile_response.data[0] if profile_response.data else None
-    
-    if not profile and email:
-        profile_response = sb_admin.table('profiles').select('id, email').eq('email', email).execute()
-        profile = profile_response.data[0] if profile_response.data else None
-        if profile:
-            sb_admin.table('profiles').update({uid_column: provider_uid}).eq('id', profile['id']).execute()
+    # 1. Try to find an existing user (by provider UID, else by email, linking the UID)
+    profile = _find_or_link_profile(sb_admin, uid_column, provider_uid, email)
 
     # If we found an existing profile, return identifiers and allow app session login
     if profile:
-        # If we have a better email now, update profiles and auth.users when placeholder is present
+        # If we have a better email now, update auth.users when placeholder is present;
+        # the on_auth_user_email_updated trigger copies it into profiles.
         if email and (not profile.get('email') or profile.get('email', '').endswith('@yourapp.com')):
             try:
-                sb_admin.table('profiles').update({'email': email}).eq('id', profile['id']).execute()
-                try:
-                    sb_admin.auth.admin.update_user(profile['id'], {'email': email})
-                except Exception:
-                    # Non-fatal if auth update fails
-                    pass
+                sb_admin.auth.admin.update_user_by_id(profile['id'], {'email': email})
                 profile['email'] = email
+                _all_users_cache.clear()
             except Exception:
+                # Non-fatal if auth update fails
                 pass
         return {
             "session": None,
@@ -144,6 +307,7 @@ def find_or_create_supabase_user(decoded_token):
         new_user = new_user_response.user
         
         sb_admin.table('profiles').update({uid_column: provider_uid}).eq('id', new_user.id).execute()
+        _all_users_cache.clear()
         
         # Skip generating Supabase session links; authenticate app-side via Flask session
         return {
@@ -158,51 +322,144 @@ def find_or_create_supabase_user(decoded_token):
         return {"session": None, "email": email, "user_id": None, "phone": phone_number, "error": str(e)}
 
 
-# --- User-Specific Data Functions (Remain the same) ---
-def get_user_scrips(user_client, user_id: str):
-    return (
-        user_client
-        .table('monitored_scrips')
-        .select('bse_code, company_name')
-        .eq('user_id', user_id)
-        .execute()
-        .data or []
-    )
-
-def get_user_recipients(user_client, user_id: str):
-    return (
-        user_client
-        .table('telegram_recipients')
-        .select('chat_id')
-        .eq('user_id', user_id)
-        .execute()
-        .data or []
-    )
+# --- User-Specific Data Functions ---
+# Watchlists are read on every dashboard render but change only through the helpers
+# below. Each gunicorn worker has its own cache, so the user helpers return a data
+# version (the time the write finished) that the app keeps in the Flask session. Entries
+# record when their read started and serve any session whose last write came before that,
+# so a user's own write misses in every worker, while several sessions of one user (phone
+# and laptop) share one entry. Admin-panel writes cannot reach the user's session; they
+# only clear the handling worker's entry, and the TTL bounds staleness elsewhere.
+_scrips_cache = TTLCache(maxsize=10_000, ttl=30)
+_recipients_cache = TTLCache(maxsize=10_000, ttl=30)
+
+def _new_data_version():
+    return time.time_ns()
+
+def _is_fresh(cached, version):
+    return cached is not None and (version is None or cached[0] >= version)
+
+def get_user_scrips(user_client, user_id: str, version=None):
+    cached = _scrips_cache.get(user_id)
+    if _is_fresh(cached, version):
+        scrips = cached[1]
+    else:
+        read_at = _new_data_version()
+        scrips = (
+            user_client
+            .table('monitored_scrips')
+            .select('bse_code, company_name')
+            .eq('user_id', user_id)
+            .execute()
+            .data or []
+        )
+        _scrips_cache.set(user_id, (read_at, scrips))
+    return scrips
+
+def get_user_recipients(user_client, user_id: str, version=None):
+    cached = _recipients_cache.get(user_id)
+    if _is_fresh(cached, version):
+        recipients = cached[1]
+    else:
+        read_at = _new_data_version()
+        recipients = (
+            user_client
+            .table('telegram_recipients')
+            .select('chat_id')
+            .eq('user_id', user_id)
+            .execute()
+            .data or []
+        )
+        _recipients_cache.set(user_id, (read_at, recipients))
+    return recipients
+
+def add_user_scrips(user_client, user_id: str, scrips: list):
+    """Inserts several {'bse_code', 'company_name'} items in a single request."""
+    rows = [{'user_id': user_id, 'bse_code': s['bse_code'], 'company_name': s['company_name']} for s in scrips]
+    if rows:
+        user_client.table('monitored_scrips').insert(rows).execute()
+    _scrips_cache.pop(user_id)
+    return _new_data_version()
 
 def add_user_scrip(user_client, user_id: str, bse_code: str, company_name: str):
-    user_client.table('monitored_scrips').insert({'user_id': user_id, 'bse_code': bse_code, 'company_name': company_name}).execute()
+    return add_user_scrips(user_client, user_id, [{'bse_code': bse_code, 'company_name': company_name}])
 
 def delete_user_scrip(user_client, user_id: str, bse_code: str):
     user_client.table('monitored_scrips').delete().eq('user_id', user_id).eq('bse_code', bse_code).execute()
+    _scrips_cache.pop(user_id)
+    return _new_data_version()
+
+def add_user_recipients(user_client, user_id: str, chat_ids: list):
+    """Upserts several chat ids in a single request."""
+    rows = [{'user_id': user_id, 'chat_id': chat_id} for chat_id in chat_ids]
+    if rows:
+        user_client.table('telegram_recipients').upsert(rows).execute()
+    _recipients_cache.pop(user_id)
+    return _new_data_version()
 
 def add_user_recipient(user_client, user_id: str, chat_id: str):
-    user_client.table('telegram_recipients').upsert({'user_id': user_id, 'chat_id': chat_id}).execute()
+    return add_user_recipients(user_client, user_id, [chat_id])
 
 def delete_user_recipient(user_client, user_id: str, chat_id: str):
     user_client.table('telegram_recipients').delete().eq('user_id', user_id).eq('chat_id', chat_id).execute()
+    _recipients_cache.pop(user_id)
+    return _new_data_version()
 
 
 # --- Admin helpers ---
-def admin_get_all_users():
-    sb_admin = get_supabase_client(service_role=True)
-    resp = sb_admin.table('profiles').select('id, email').order('email').execute()
-    return resp.data or []
+# The admin user picker is rebuilt on every admin page view; the list changes rarely.
+ADMIN_USERS_PAGE_SIZE = 100
+_all_users_cache = TTLCache(maxsize=64, ttl=60)
+
+def admin_get_users_page(page: int = 0):
+    """Returns (users, has_more) for one page of the admin user picker."""
+    cached = _all_users_cache.get(page)
+    if cached is None:
+        sb_admin = get_supabase_client(service_role=True)
+        offset = page * ADMIN_USERS_PAGE_SIZE
+        # Ask for one extra row to learn whether a next page exists.
+        try:
+            rows = sb_admin.rpc('list_profiles', {
+                'p_limit': ADMIN_USERS_PAGE_SIZE + 1,
+                'p_offset': offset,
+            }).execute().data or []
+        except Exception as e:
+            # Same page through a ranged table query if the migration has not been applied yet.
+            print(f"list_profiles RPC failed, using table query: {e}")
+            rows = (
+                sb_admin
+                .table('profiles')
+                .select('id, email')
+                .order('email')
+                .order('id')
+                .range(offset, offset + ADMIN_USERS_PAGE_SIZE)
+                .execute()
+                .data or []
+            )
+        cached = (rows[:ADMIN_USERS_PAGE_SIZE], len(rows) > ADMIN_USERS_PAGE_SIZE)
+        _all_users_cache.set(page, cached)
+    return cached
 
 def admin_get_user_details(user_id: str):
     sb_admin = get_supabase_client(service_role=True)
-    profile = sb_admin.table('profiles').select('id, email').eq('id', user_id).single().execute().data
-    scrips = sb_admin.table('monitored_scrips').select('bse_code, company_name').eq('user_id', user_id).execute().data or []
-    recipients = sb_admin.table('telegram_recipients').select('chat_id').eq('user_id', user_id).execute().data or []
+    try:
+        # One request: the child tables are embedded through their foreign keys to profiles.
+        profile = (
+            sb_admin
+            .table('profiles')
+            .select('id, email, monitored_scrips(bse_code, company_name), telegram_recipients(chat_id)')
+            .eq('id', user_id)
+            .single()
+            .execute()
+            .data
+        )
+        scrips = profile.get('monitored_scrips') or []
+        recipients = profile.get('telegram_recipients') or []
+    except Exception as e:
+        print(f"Embedded user details query failed, using separate queries: {e}")
+        profile = sb_admin.table('profiles').select('id, email').eq('id', user_id).single().execute().data
+        scrips = sb_admin.table('monitored_scrips').select('bse_code, company_name').eq('user_id', user_id).execute().data or []
+        recipients = sb_admin.table('telegram_recipients').select('chat_id').eq('user_id', user_id).execute().data or []
     return {
         'id': profile['id'],
         'email': profile.get('email', ''),
@@ -210,18 +467,24 @@ def admin_get_user_details(user_id: str):
         'recipients': recipients,
     }
 
+def admin_add_scrips_for_user(user_id: str, scrips: list):
+    add_user_scrips(get_supabase_client(service_role=True), user_id, scrips)
+
 def admin_add_scrip_for_user(user_id: str, bse_code: str, company_name: str):
-    sb_admin = get_supabase_client(service_role=True)
-    sb_admin.table('monitored_scrips').insert({'user_id': user_id, 'bse_code': bse_code, 'company_name': company_name}).execute()
+    admin_add_scrips_for_user(user_id, [{'bse_code': bse_code, 'company_name': company_name}])
 
 def admin_delete_scrip_for_user(user_id: str, bse_code: str):
     sb_admin = get_supabase_client(service_role=True)
     sb_admin.table('monitored_scrips').delete().eq('user_id', user_id).eq('bse_code', bse_code).execute()
+    _scrips_cache.pop(user_id)
+
+def admin_add_recipients_for_user(user_id: str, chat_ids: list):
+    add_user_recipients(get_supabase_client(service_role=True), user_id, chat_ids)
 
 def admin_add_recipient_for_user(user_id: str, chat_id: str):
-    sb_admin = get_supabase_client(service_role=True)
-    sb_admin.table('telegram_recipients').upsert({'user_id': user_id, 'chat_id': chat_id}).execute()
+    admin_add_recipients_for_user(user_id, [chat_id])
 
 def admin_delete_recipient_for_user(user_id: str, chat_id: str):
     sb_admin = get_supabase_client(service_role=True)
     sb_admin.table('telegram_recipients').delete().eq('user_id', user_id).eq('chat_id', chat_id).execute()
+    _recipients_cache.pop(user_id)
@@ -0,0 +1,7 @@
+# Gunicorn loads ./gunicorn.conf.py automatically; command-line flags live in render.yaml.
+
+def post_fork(server, worker):
+    # Threads started while --preload imports the app stay in the master, so each
+    # worker starts its own Firebase public key refresher.
+    import database
+    database.start_firebase_key_refresher()
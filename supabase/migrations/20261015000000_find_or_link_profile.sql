@@ -0,0 +1,36 @@
+-- Resolves a Firebase/Google login to a profile in a single round-trip: match on the
+-- provider UID column first, otherwise on email, linking the UID to that profile.
+create or replace function public.find_or_link_profile(
+    p_provider_uid text,
+    p_uid_column text,
+    p_email text default null
+)
+returns table (id uuid, email text)
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if p_uid_column not in ('firebase_uid', 'google_uid') then
+        raise exception 'unsupported uid column: %', p_uid_column;
+    end if;
+
+    return query execute format(
+        'select p.id::uuid, p.email::text from profiles p where p.%I = $1 limit 1',
+        p_uid_column
+    ) using p_provider_uid;
+    if found or p_email is null then
+        return;
+    end if;
+
+    return query execute format(
+        'update profiles p set %I = $1
+          where p.id = (select q.id from profiles q where q.email = $2 limit 1 for update)
+          returning p.id::uuid, p.email::text',
+        p_uid_column
+    ) using p_provider_uid, p_email;
+end;
+$$;
+
+revoke execute on function public.find_or_link_profile(text, text, text) from public, anon, authenticated;
+grant execute on function public.find_or_link_profile(text, text, text) to service_role;
@@ -0,0 +1,27 @@
+-- Foreign keys from the per-user tables to profiles, so PostgREST can embed them in a
+-- profiles query (admin_get_user_details). NOT VALID skips checking existing rows.
+do $$
+begin
+    if not exists (
+        select 1 from pg_constraint
+        where conrelid = 'public.monitored_scrips'::regclass
+          and confrelid = 'public.profiles'::regclass
+          and contype = 'f'
+    ) then
+        alter table public.monitored_scrips
+            add constraint monitored_scrips_user_id_profiles_fkey
+            foreign key (user_id) references public.profiles (id) not valid;
+    end if;
+
+    if not exists (
+        select 1 from pg_constraint
+        where conrelid = 'public.telegram_recipients'::regclass
+          and confrelid = 'public.profiles'::regclass
+          and contype = 'f'
+    ) then
+        alter table public.telegram_recipients
+            add constraint telegram_recipients_user_id_profiles_fkey
+            foreign key (user_id) references public.profiles (id) not valid;
+    end if;
+end;
+$$;
@@ -0,0 +1,17 @@
+-- One page of the admin user picker, ordered by email, so the admin panel never
+-- pulls the whole profiles table in a single response.
+create or replace function public.list_profiles(p_limit int, p_offset int)
+returns table (id uuid, email text)
+language sql
+stable
+set search_path = public
+as $$
+    select p.id::uuid, p.email::text
+      from profiles p
+     order by p.email, p.id
+     limit p_limit
+    offset p_offset;
+$$;
+
+revoke execute on function public.list_profiles(int, int) from public, anon, authenticated;
+grant execute on function public.list_profiles(int, int) to service_role;
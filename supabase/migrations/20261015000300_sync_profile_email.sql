@@ -0,0 +1,32 @@
+-- Keep profiles.email in step with auth.users.email, so an admin update of the
+-- auth email is the only call needed when a placeholder address is replaced.
+create or replace function public.sync_profile_email()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    update profiles set email = new.email where id = new.id;
+    return new;
+end;
+$$;
+
+revoke execute on function public.sync_profile_email() from public, anon, authenticated;
+
+drop trigger if exists on_auth_user_email_updated on auth.users;
+create trigger on_auth_user_email_updated
+    after update of email on auth.users
+    for each row
+    when (old.email is distinct from new.email)
+    execute function public.sync_profile_email();
+
+-- Catch up profiles whose auth email was upgraded before this trigger existed. Later
+-- logins send the same email again, so the trigger alone would never fire for them.
+update profiles p
+   set email = u.email
+  from auth.users u
+ where u.id = p.id
+   and (p.email is null or p.email = '' or p.email like '%@yourapp.com')
+   and u.email is not null
+   and u.email not like '%@yourapp.com';
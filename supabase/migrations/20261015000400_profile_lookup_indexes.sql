@@ -0,0 +1,5 @@
+-- Logins resolve a profile by provider UID and then by email (find_or_link_profile and
+-- its table-query fallback); index those columns so each lookup stops at the match.
+create index if not exists profiles_firebase_uid_idx on public.profiles (firebase_uid);
+create index if not exists profiles_google_uid_idx on public.profiles (google_uid);
+create index if not exists profiles_email_idx on public.profiles (email);
@@ -0,0 +1,54 @@
+-- RLS policies that call auth.uid() directly evaluate it once per row. Wrapping the call
+-- as (select auth.uid()) turns it into an initPlan that runs once per query. The
+-- policies were created in the dashboard, so rewrite whatever is defined on the app's
+-- tables rather than restating them here.
+do $$
+declare
+    pol record;
+    new_qual text;
+    new_check text;
+    stmt text;
+begin
+    for pol in
+        select schemaname, tablename, policyname, qual, with_check
+          from pg_policies
+         where schemaname = 'public'
+           and tablename in ('profiles', 'monitored_scrips', 'telegram_recipients')
+    loop
+        -- Skip calls that are already wrapped (deparsed as "SELECT auth.uid() AS uid").
+        new_qual := regexp_replace(pol.qual, '(?<!SELECT )auth\.uid\(\)', '(select auth.uid())', 'g');
+        new_check := regexp_replace(pol.with_check, '(?<!SELECT )auth\.uid\(\)', '(select auth.uid())', 'g');
+        if new_qual is not distinct from pol.qual and new_check is not distinct from pol.with_check then
+            continue;
+        end if;
+
+        stmt := format('alter policy %I on %I.%I', pol.policyname, pol.schemaname, pol.tablename);
+        if new_qual is not null then
+            stmt := stmt || format(' using (%s)', new_qual);
+        end if;
+        if new_check is not null then
+            stmt := stmt || format(' with check (%s)', new_check);
+        end if;
+        execute stmt;
+    end loop;
+end;
+$$;
+
+-- The policies filter on user_id; make sure each child table has an index leading with it.
+do $$
+declare
+    tbl text;
+begin
+    foreach tbl in array array['monitored_scrips', 'telegram_recipients'] loop
+        if not exists (
+            select 1
+              from pg_index i
+              join pg_attribute a on a.attrelid = i.indrelid and a.attnum = i.indkey[0]
+             where i.indrelid = format('public.%I', tbl)::regclass
+               and a.attname = 'user_id'
+        ) then
+            execute format('create index %I on public.%I (user_id)', tbl || '_user_id_idx', tbl);
+        end if;
+    end loop;
+end;
+$$;